@@ -1,7 +1,8 @@
 '''Playing around with Merkle Trees
 
 This is based on my reading on Bitcoin.
-Implemented as binary trees from bottom to top.
+Implemented as binary trees from bottom to top. When a level has an
+odd number of nodes, its last node is duplicated to complete the pair.
 
 Tree is considered immutable after creation, so the mutability
 of the tree after the __init__ method is avoided by design
@@ -11,31 +12,41 @@ Date Started: 2017-01-13
 '''
 
 import hashlib
-import itertools
-from collections import OrderedDict
-from typing import List, Optional
+from typing import Iterable, List, Optional
 
+_sha3_256 = hashlib.sha3_256
 
-def hash_alg(inval: str) -> str:
-    '''Hash a given input value'''
-    return hashlib.sha3_256(inval.encode()).hexdigest()
 
+def hash_alg(inval: bytes) -> bytes:
+    '''Hash a given input value, returning the raw 32-byte digest'''
+    return _sha3_256(inval).digest()
 
-def grouper(iterable, n, fillvalue=None):
-    "Collect data into fixed-length chunks or blocks"
-    # grouper('ABCDEFG', 3, 'x') --> ABC DEF Gxx"
-    args = [iter(iterable)] * n
-    return itertools.zip_longest(*args, fillvalue=fillvalue)
+
+def hash_many(invals: Iterable[bytes]) -> List[bytes]:
+    '''Hash every input value with hash_alg, returning digests in order'''
+    return [hash_alg(inval) for inval in invals]
+
+
+def hash_pair(left: bytes, right: bytes) -> bytes:
+    '''Hash two concatenated child digests into their parent digest
+
+    Two 32-byte digests make a 64-byte message, which fits in a single
+    SHA3-256 block (rate of 136 bytes), so every internal node costs one
+    Keccak-f permutation.
+    '''
+    return _sha3_256(left + right).digest()
 
 
 class Node:
     '''A node within a MerkleTree'''
 
+    __slots__ = ('left', 'right', 'parent', 'value')
+
     def __init__(
             self,
             left: Optional['Node'] = None,
             right: Optional['Node'] = None,
-            value: Optional[str] = None,
+            value: Optional[bytes] = None,
     ) -> None:
         bool_no_children = left is None and right is None
         bool_children = left is not None and right is not None
@@ -51,27 +62,35 @@ class Node:
         self.left = left
         self.right = right
         self.parent = None  # type: Optional[Node]
-        self.value = value if bool_no_children else hash_alg(
-            self.left.value + self.right.value
+        self.value = value if bool_no_children else hash_pair(
+            self.left.value, self.right.value
         )
 
         if bool_children:
             self.left.parent = self
             self.right.parent = self
 
-    def __str__(self, level=0) -> str:
-        '''Print out a tree
-
-        See the following stack overflow post for inspiration
-        https://stackoverflow.com/questions/20242479/\
-            printing-a-tree-data-structure-in-python
-        '''
-        ret = "\t" * level + repr(self.value) + "\n"
-        if self.left:
-            ret += self.left.__str__(level + 1)
-        if self.right:
-            ret += self.right.__str__(level + 1)
-        return ret
+    @classmethod
+    def leaf(cls, value: bytes) -> 'Node':
+        '''Create a leaf Node, skipping the argument checks of __init__'''
+        node = cls.__new__(cls)
+        node.left = None
+        node.right = None
+        node.parent = None
+        node.value = value
+        return node
+
+    @classmethod
+    def internal(cls, left: 'Node', right: 'Node') -> 'Node':
+        '''Create the parent Node of two children, skipping the checks'''
+        node = cls.__new__(cls)
+        node.left = left
+        node.right = right
+        node.parent = None
+        node.value = hash_pair(left.value, right.value)
+        left.parent = node
+        right.parent = node
+        return node
 
     def __repr__(self) -> str:
         return '<tree node representation>'
@@ -80,58 +99,105 @@ class Node:
 class MerkleTree:
     '''The Merkle tree data structure'''
 
-    def __init__(self, transactions_hashed: List[str]):
+    def __init__(self, transactions_hashed: List[bytes]):
         '''Initializer
 
         :param transaction_hashed:
-            transaction hashes to be placed in initial tree
+            transaction digests (raw bytes) to be placed in initial tree
         '''
-        self.base_nodes = OrderedDict([
-            (transaction, Node(value=transaction))
-            for transaction in transactions_hashed
-        ])
-        if len(self.base_nodes) != len(transactions_hashed):
+        if not transactions_hashed:
+            raise ValueError('Transactions must not be empty')
+        if len(set(transactions_hashed)) != len(transactions_hashed):
             raise ValueError('Transactions must be a unique list')
+        self.base_nodes = {
+            transaction: Node.leaf(transaction)
+            for transaction in transactions_hashed
+        }
         self.root_node = self._get_root_node()
         self._str = None  # type: Optional[str]
 
+    @classmethod
+    def from_raw(cls, transactions: Iterable[bytes]) -> 'MerkleTree':
+        '''Build a tree directly from raw (not yet hashed) transactions
+
+        Convenience wrapper that hashes each transaction with hash_alg
+        (via hash_many) and passes the digests to the initializer.
+
+        :param transactions: raw transaction bytes
+        '''
+        return cls(hash_many(transactions))
+
     def _get_root_node(self) -> Node:
-        '''Construct the Merkle Tree, culminating at the root Node'''
+        '''Construct the Merkle Tree, culminating at the root Node
+
+        As in Bitcoin, a level with an odd number of nodes has its last
+        node paired with itself, so every level is made of complete pairs
+        '''
         node_stack = list(self.base_nodes.values())
-        while True:
-            if len(node_stack) is 1:
-                return node_stack[0]
-            temp_node_stack = []
-            for left, right in grouper(node_stack, 2):
-                if right is None:
-                    temp_node_stack.append(left)
-                else:
-                    temp_node_stack.append(Node(left=left, right=right))
-            node_stack = temp_node_stack.copy()
+        while len(node_stack) > 1:
+            if len(node_stack) & 1:
+                node_stack.append(node_stack[-1])
+            node_stack = [
+                Node.internal(left, right)
+                for left, right in zip(node_stack[0::2], node_stack[1::2])
+            ]
+        return node_stack[0]
 
     @property
-    def root_hash(self) -> str:
-        '''Obtain root hash'''
+    def root_hash(self) -> bytes:
+        '''Obtain root hash as raw digest bytes'''
         return self.root_node.value
 
-    def is_valid_leaf(self, root_hash: str, leaf_value: str) -> bool:
+    def is_valid_leaf(self, root_hash: bytes, leaf_value: bytes) -> bool:
         '''Check that a hashed value of a leaf is valid
 
-        This still a work in progress; not sure if this actually solves
-        the problem. Should probably do some real tree-climbing work.
+        Climbs from the leaf to the root, hashing the running digest with
+        each sibling along the way, and compares the result to root_hash.
+        Costs one hash_pair call per level.
         '''
-        return leaf_value in self.base_nodes and root_hash == self.root_hash
+        node = self.base_nodes.get(leaf_value)
+        if node is None:
+            return False
+        current = node.value
+        parent = node.parent
+        while parent is not None:
+            if parent.left is node:
+                current = hash_pair(current, parent.right.value)
+            else:
+                current = hash_pair(parent.left.value, current)
+            node = parent
+            parent = node.parent
+        return current == root_hash
 
     def __str__(self) -> str:
-        '''The string representation of the hash tree'''
-        return str(self.root_node)
+        '''The string representation of the hash tree
+
+        Walks the tree depth-first without recursion, left child first.
+        See the following stack overflow post for inspiration
+        https://stackoverflow.com/questions/20242479/\
+            printing-a-tree-data-structure-in-python
+        '''
+        if self._str is None:
+            parts = []  # type: List[str]
+            stack = [(self.root_node, 0)]
+            while stack:
+                node, level = stack.pop()
+                parts.append('\t' * level)
+                parts.append(node.value.hex())
+                parts.append('\n')
+                if node.right:
+                    stack.append((node.right, level + 1))
+                if node.left:
+                    stack.append((node.left, level + 1))
+            self._str = ''.join(parts)
+        return self._str
 
 
 if __name__ == '__main__':
     transactions = ['hello', 'world', 'my', 'favorite', 'person']
-    hash_transactions = [hash_alg(t) for t in transactions]
-    merkle_tree = MerkleTree(hash_transactions)
+    merkle_tree = MerkleTree.from_raw([t.encode() for t in transactions])
+    hash_transactions = list(merkle_tree.base_nodes)
     for transaction, hash_transaction in zip(transactions, hash_transactions):
-        print(f'{transaction} :: {hash_transaction}')
+        print(f'{transaction} :: {hash_transaction.hex()}')
     print('------------------------------------------------')
     print(merkle_tree)